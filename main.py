@@ -1,20 +1,27 @@
-import pyautogui
-import pytesseract
+import mss
+import mss.exception
 import cv2
 import numpy as np
-import pandas as pd
 import time
 import re
 import tkinter as tk
 import threading
 import argparse
+import asyncio
+import concurrent.futures
+import contextlib
 import glob
-from PIL import Image
 import json
 import os
-import base64
+import hashlib
+import io
 from dotenv import load_dotenv
 
+# Make sure OpenCV uses its SIMD-optimized kernels (blur, threshold, resize)
+# on every core. AVX2 paths need an OpenCV build with CPU_DISPATCH=AVX2;
+# check cv2.getBuildInformation() for "CPU/HW features" if unsure.
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 1)
 
 # --- 1. Locate the Game Window (Manual Step for Initial Setup) ---
 # You'll need to manually determine these coordinates and dimensions once.
@@ -27,60 +34,316 @@ GAME_WINDOW_REGION = (
     750,
     500,
 )  # (left, top, width, height) of the list area
+# Part of the captured region that holds the player names and points, as
+# (left, top, width, height) relative to GAME_WINDOW_REGION. Only this part
+# is sent to Gemini; narrow it to the name/points column to shrink uploads.
+NAME_POINTS_SUBREGION = (0, 0, GAME_WINDOW_REGION[2], GAME_WINDOW_REGION[3])
 MAX_CAPTURES = 1000  # Maximum number of screenshots to take
+CAPTURE_QUEUE_SIZE = 8  # Max captured frames waiting to be encoded
+DHASH_SIZE = 32  # dHash grid size; gives DHASH_SIZE**2-bit hashes
+DUPLICATE_HASH_THRESHOLD = 12  # Max differing dHash bits to treat frames as identical
 ANALYSIS_FOLDER = "analysis"
+OCR_MIN_HEIGHT = 600  # Images shorter than this are upscaled 2x before OCR
+DEBUG_OCR = False  # Save processed_*.png OCR inputs (--debug-ocr or GUILDBOT_DEBUG=1)
+SESSION_TIFF = os.path.join(ANALYSIS_FOLDER, "session.tiff")  # Saved captures
+SESSION_TIFF_TMP = SESSION_TIFF + ".part"  # Session being written
+GEMINI_CACHE_FILE = os.path.join(ANALYSIS_FOLDER, ".gemini_cache.json")
+GEMINI_BATCH_SIZE = 8  # Images per Gemini request
+GEMINI_MAX_CONCURRENCY = 4  # Gemini requests in flight at once
+GEMINI_MAX_RETRIES = 3  # Attempts per batch before giving up on it
+GEMINI_RETRY_BASE_DELAY = 2  # Seconds, doubled after each failed attempt
+
+
+# Regex to find a line holding a name followed by numbers (points).
+# This pattern assumes names are typically alphanumeric and points are numbers.
+# Name (letters, numbers, underscore, space, hyphen), then whitespace and
+# 3-5 digits (points) at the end of the line. [^\S\n] is whitespace that
+# stays on the same line, so one scan over the whole text matches per line.
+_NAME_POINTS_PATTERN = re.compile(
+    r"^[^\S\n]*([A-Za-z0-9_ -]+?)[^\S\n]+(\d{3,5})[^\S\n]*$", re.MULTILINE
+)
+_NAME_CLEAN_PATTERN = re.compile(r"[^A-Za-z0-9_ ]")
+
+
+# Working buffers for preprocess_image_for_ocr, sized lazily on first use
+_buf_gray = None
+_buf_blur = None
+_buf_thresh = None
 
 
 # --- Helper Functions ---
 
 
-def preprocess_image_for_ocr(image_path):
+def preprocess_image_for_ocr(image_path, debug=None):
     """
     Loads an image, converts it to grayscale, applies thresholding,
     and returns the processed image for better OCR.
+    The returned array is a shared buffer overwritten by the next call.
+    If debug is true (default: DEBUG_OCR), the result is also saved to disk.
     """
     img = cv2.imread(image_path)
     if img is None:
         raise FileNotFoundError(f"Image not found at {image_path}")
 
     # --- Advanced Preprocessing Pipeline ---
-    # 1. Resize image to make it larger (Tesseract works better on higher DPI images)
-    scale_factor = 2
-    width = int(img.shape[1] * scale_factor)
-    height = int(img.shape[0] * scale_factor)
-    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
+    # 1. Resize small images to make them larger (Tesseract works better on
+    # higher DPI images); captures that are already tall enough are left as is
+    if img.shape[0] < OCR_MIN_HEIGHT:
+        img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_LINEAR)
+
+    # Reuse the working buffers across calls instead of allocating new images
+    global _buf_gray, _buf_blur, _buf_thresh
+    if _buf_gray is None or _buf_gray.shape != img.shape[:2]:
+        _buf_gray = np.empty(img.shape[:2], np.uint8)
+        _buf_blur = np.empty_like(_buf_gray)
+        _buf_thresh = np.empty_like(_buf_gray)
 
     # 2. Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_buf_gray)
 
     # 3. Apply a median blur to reduce salt-and-pepper noise
-    blurred = cv2.medianBlur(gray, 3)
+    cv2.medianBlur(_buf_gray, 3, dst=_buf_blur)
 
-    # 4. Use adaptive thresholding
+    # 4. Use adaptive thresholding, inverted in the same pass
+    # (Tesseract often performs better on black text on white background)
     processed_img = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 5
+        _buf_blur,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV,
+        11,
+        5,
+        dst=_buf_thresh,
     )
 
-    # 5. Invert the image (Tesseract often performs better on black text on white background)
-    processed_img = cv2.bitwise_not(processed_img)
-
     # Save the processed image for debugging to see what Tesseract is processing
-    processed_filename = os.path.join(
-        ANALYSIS_FOLDER, "processed_" + os.path.basename(image_path)
-    )
-    cv2.imwrite(processed_filename, processed_img)
-    print(f"  Saved processed image to {processed_filename}")
+    if debug is None:
+        debug = DEBUG_OCR
+    if debug:
+        processed_filename = os.path.join(
+            ANALYSIS_FOLDER, "processed_" + os.path.basename(image_path)
+        )
+        cv2.imwrite(processed_filename, processed_img)
+        print(f"  Saved processed image to {processed_filename}")
 
     return processed_img
 
 
-def extract_with_gemini(image_paths, resize_factor=1.0):
+def dhash(image):
+    """
+    Computes a difference hash of an RGB image array from a grayscale
+    thumbnail of (DHASH_SIZE + 1) x DHASH_SIZE pixels, returned as an int
+    of DHASH_SIZE**2 bits. Frames that only differ by antialiasing flicker
+    hash alike, while pages of the list scrolled by a row do not.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    g = cv2.resize(gray, (DHASH_SIZE + 1, DHASH_SIZE), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(g[:, 1:] > g[:, :-1]).tobytes(), "big")
+
+
+def hash_distance(hash1, hash2):
+    """Returns the number of differing bits between two dHashes."""
+    return (hash1 ^ hash2).bit_count()
+
+
+def drop_near_duplicate_frames(frames):
+    """
+    Takes (dhash, PNG bytes) pairs and returns the PNG bytes of the frames
+    whose dHash differs by more than DUPLICATE_HASH_THRESHOLD bits from the
+    last kept frame, i.e. drops frames taken without scrolling. Comparing
+    against the last kept frame (not all earlier ones, as different pages
+    of the list can look alike) means a slow scroll still keeps a frame
+    once it has drifted far enough.
+    """
+    unique_images = []
+    kept_hash = None
+    for current_hash, data in frames:
+        if (
+            kept_hash is None
+            or hash_distance(current_hash, kept_hash) > DUPLICATE_HASH_THRESHOLD
+        ):
+            unique_images.append(data)
+            kept_hash = current_hash
+    return unique_images
+
+
+def _encode_screenshot(image, crop=None):
+    """
+    PNG-encodes an RGB capture and returns the bytes. If crop is given as
+    (left, top, width, height), only that part of the image is encoded.
+    """
+    if crop is not None:
+        left, top, width, height = crop
+        image = image[top : top + height, left : left + width]
+    ok, buf = cv2.imencode(".png", image[:, :, ::-1])
+    if not ok:
+        raise ValueError("Could not encode screenshot")
+    return buf.tobytes()
+
+
+def save_session(images):
+    """
+    Writes PNG-encoded frames to SESSION_TIFF, replacing the previous
+    session only once every frame has been written.
+    """
+    import tifffile
+
+    with tifffile.TiffWriter(SESSION_TIFF_TMP, bigtiff=True) as tif:
+        for data in images:
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            tif.write(image[:, :, ::-1], photometric="rgb", compression="zlib")
+    os.replace(SESSION_TIFF_TMP, SESSION_TIFF)
+
+
+def _load_upload_cache():
+    """Loads the content-hash -> Gemini file name cache from disk."""
+    try:
+        with open(GEMINI_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_upload_cache(cache):
+    """Persists the content-hash -> Gemini file name cache to disk."""
+    os.makedirs(os.path.dirname(GEMINI_CACHE_FILE), exist_ok=True)
+    with open(GEMINI_CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+def _encode_for_gemini(image_bytes, resize_factor=1.0):
+    """
+    Returns (bytes, mime_type) for a PNG-encoded image to send to Gemini.
+    When resize_factor < 1.0 the image is downscaled and re-encoded as JPEG
+    in memory, which shrinks the upload considerably.
+    """
+    if resize_factor >= 1.0:
+        return image_bytes, "image/png"
+
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode screenshot for Gemini")
+    img = cv2.resize(
+        img, (0, 0), fx=resize_factor, fy=resize_factor, interpolation=cv2.INTER_AREA
+    )
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError("Could not encode screenshot for Gemini")
+    return buf.tobytes(), "image/jpeg"
+
+
+async def _upload_cached(client, cache, data, mime_type):
+    """
+    Returns a Gemini file handle for the image bytes, uploading them only if
+    the same content hasn't been uploaded before. Uploaded files expire on
+    Google's side after a while, so a stale cache entry triggers a re-upload.
     """
-    Uses Google Gemini to extract names and points from a batch of images.
+    content_hash = hashlib.blake2b(data).hexdigest()
+
+    file_name = cache.get(content_hash)
+    if file_name:
+        try:
+            return await client.aio.files.get(name=file_name)
+        except Exception:
+            print(f"  Cached upload {file_name} expired, re-uploading.")
+
+    uploaded_file = await client.aio.files.upload(
+        file=io.BytesIO(data), config={"mime_type": mime_type}
+    )
+    cache[content_hash] = uploaded_file.name
+    return uploaded_file
+
+
+async def _extract_batch(
+    client, semaphore, upload_cache, prompt, batch_images, batch_number, resize_factor
+):
+    """
+    Sends one sub-batch of images to Gemini and returns its players list.
+    Failed attempts are retried with exponential backoff; if every attempt
+    fails, the batch contributes no members instead of aborting the run.
+    """
+    uploaded_files = None
+    for attempt in range(1, GEMINI_MAX_RETRIES + 1):
+        response = None
+        try:
+            # Only hold a concurrency slot while talking to the API, so a
+            # batch backing off doesn't block healthy ones
+            async with semaphore:
+                # Upload the batch's images concurrently, once; retries reuse
+                # the file handles
+                if uploaded_files is None:
+                    uploaded_files = await asyncio.gather(
+                        *(
+                            _upload_cached(
+                                client,
+                                upload_cache,
+                                *_encode_for_gemini(image_bytes, resize_factor),
+                            )
+                            for image_bytes in batch_images
+                        )
+                    )
+
+                response = await client.aio.models.generate_content(
+                    model="gemini-2.5-flash", contents=[prompt, *uploaded_files]
+                )
+
+            cleaned_response = (
+                response.text.strip().replace("```json", "").replace("```", "")
+            )
+            data = json.loads(cleaned_response)
+            if "players" in data and isinstance(data["players"], list):
+                print(
+                    f"  Extracted {len(data['players'])} members from batch {batch_number}."
+                )
+                return data["players"]
+            print(
+                f"  Warning: Gemini response for batch {batch_number} did not contain a 'players' list."
+            )
+            return []
+        except Exception as e:
+            print(
+                f"  Batch {batch_number}, attempt {attempt}/{GEMINI_MAX_RETRIES}: "
+                f"error calling Gemini API or parsing response: {e}"
+            )
+            if response is not None:
+                print(f"  Raw response was: {response.text}")
+            if attempt < GEMINI_MAX_RETRIES:
+                await asyncio.sleep(GEMINI_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+
+    print(f"  Giving up on batch {batch_number} after {GEMINI_MAX_RETRIES} attempts.")
+    return []
+
+
+def _member_key(player):
+    """
+    Returns the (Name, Points) dedupe key for a player entry from Gemini,
+    with Points normalised to int where possible (empty counts as 0), or
+    None if the entry is malformed.
+    """
+    if not isinstance(player, dict):
+        return None
+    points = player.get("Points") or 0
+    try:
+        points = int(points)
+    except (TypeError, ValueError):
+        pass
+    key = (player.get("Name"), points)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+async def extract_with_gemini(images, resize_factor=1.0):
+    """
+    Uses Google Gemini to extract names and points from a batch of
+    PNG-encoded images (a list of bytes). Byte-identical images are sent once.
+    Images are split into sub-batches that are sent concurrently, and
+    players repeated across batches are returned only once.
     Optionally resizes images to reduce cost.
     """
     from google import genai
-    from google.genai import types
 
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
@@ -91,9 +354,24 @@ def extract_with_gemini(image_paths, resize_factor=1.0):
 
     client = genai.Client(api_key=api_key)
 
-    all_members = []
-    chunk_paths = image_paths
-    print(f"Processing batch of {len(chunk_paths)} images with Gemini...")
+    # Skip byte-identical images so they don't cost tokens twice
+    seen_hashes = set()
+    unique_images = []
+    for image_bytes in images:
+        digest = hashlib.sha256(image_bytes).digest()
+        if digest in seen_hashes:
+            continue
+        seen_hashes.add(digest)
+        unique_images.append(image_bytes)
+    if len(unique_images) < len(images):
+        print(f"Skipping {len(images) - len(unique_images)} duplicate images.")
+    images = unique_images
+
+    batches = [
+        images[i : i + GEMINI_BATCH_SIZE]
+        for i in range(0, len(images), GEMINI_BATCH_SIZE)
+    ]
+    print(f"Processing {len(images)} images with Gemini in {len(batches)} batches...")
 
     prompt = """
     Analyze the following screenshots from a game's guild member list.
@@ -105,33 +383,75 @@ def extract_with_gemini(image_paths, resize_factor=1.0):
     Example format: {"players": [{"Name": "Player1", "Points": 1500}, {"Name": "Player2", "Points": 1450}]}
     Do not include players with the same name and points multiple times. Members can have 0 points, with the field left empty.
     """
-    contents = [prompt]
-    for image_path in chunk_paths:
-        with open(image_path, "rb") as f:
-            img2_bytes = f.read()
-            contents.append(
-                types.Part.from_bytes(data=img2_bytes, mime_type="image/png")
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    upload_cache = _load_upload_cache()
+    try:
+        results = await asyncio.gather(
+            *(
+                _extract_batch(
+                    client,
+                    semaphore,
+                    upload_cache,
+                    prompt,
+                    batch,
+                    batch_number,
+                    resize_factor,
+                )
+                for batch_number, batch in enumerate(batches, start=1)
             )
+        )
+    finally:
+        # Keep whatever was uploaded, even if a later step failed
+        _save_upload_cache(upload_cache)
+
+    # Drop players repeated across overlapping screenshots while merging
+    all_members = []
+    seen = set()
+    for players in results:
+        for player in players:
+            key = _member_key(player)
+            if key is None:
+                print(f"  Skipping malformed player entry: {player!r}")
+                continue
+            if key in seen:
+                continue
+            seen.add(key)
+            # Export the normalised points, whichever form Gemini used
+            all_members.append({**player, "Points": key[1]})
+    return all_members
 
+
+def positive_float(value):
+    """Parses a command line value as a float greater than zero."""
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash", contents=contents
-        )
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number, got '{value}'") from None
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got '{value}'")
+    return number
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "")
-        )
-        data = json.loads(cleaned_response)
-        if "players" in data and isinstance(data["players"], list):
-            all_members.extend(data["players"])
-            print(f"  Extracted {len(data['players'])} members from this batch.")
-        else:
-            print("  Warning: Gemini response did not contain a 'players' list.")
-    except Exception as e:
-        print(f"  An error occurred calling Gemini API or parsing response: {e}")
-        print(f"  Raw response was: {response.text}")
 
-    return all_members
+def parse_crop(value):
+    """
+    Parses a 'L,T,W,H' command line value into a crop tuple that must lie
+    inside the GAME_WINDOW_REGION capture.
+    """
+    try:
+        left, top, width, height = (int(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected four comma-separated integers L,T,W,H, got '{value}'"
+        ) from None
+    if min(left, top) < 0 or min(width, height) <= 0:
+        raise argparse.ArgumentTypeError(f"invalid crop region '{value}'")
+    region_width, region_height = GAME_WINDOW_REGION[2:]
+    if left + width > region_width or top + height > region_height:
+        raise argparse.ArgumentTypeError(
+            f"crop region '{value}' does not fit inside the "
+            f"{region_width}x{region_height} capture region"
+        )
+    return left, top, width, height
 
 
 # --- GUI and Stop Flag ---
@@ -166,28 +486,14 @@ def extract_names_and_points(text):
     Parses the OCR'd text to extract names and points.
     This regex needs to be robust for various OCR errors.
     """
-    names_points = []
-    # Regex to find a word (name) followed by numbers (points)
-    # It tries to be flexible with common OCR mistakes (e.g., 'O' instead of '0')
-    # This pattern assumes names are typically alphanumeric and points are numbers.
-    # It also accounts for potential extra characters or spaces between.
-    pattern = r"([A-Za-z0-9_ -]+)\s*(\d{3,5})"  # Name (letters, numbers, underscore, space, hyphen), then 3-5 digits (points)
-
-    lines = text.split("\n")
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        match = re.search(pattern, line)
-        if match:
-            name = match.group(1).strip()
-            points = match.group(2).strip()
-            # Basic cleaning for names (remove common OCR artifacts)
-            name = re.sub(r"[^A-Za-z0-9_ ]", "", name).strip()
-            names_points.append({"Name": name, "Points": int(points)})
-            # print(f"  Found: Name='{name}', Points='{points}'")
-    return names_points
+    # Basic cleaning for names (remove common OCR artifacts)
+    return [
+        {
+            "Name": _NAME_CLEAN_PATTERN.sub("", match.group(1)).strip(),
+            "Points": int(match.group(2)),
+        }
+        for match in _NAME_POINTS_PATTERN.finditer(text)
+    ]
 
 
 # --- Main Script ---
@@ -202,21 +508,44 @@ if __name__ == "__main__":
     parser.add_argument(
         "--analyze-only",
         action="store_true",
-        help="Skip capture phase and only analyze existing guild_screenshot_*.png files.",
+        help="Skip capture phase and only analyze screenshots saved in analysis/session.tiff.",
     )
 
     parser.add_argument(
         "--gemini-resize-factor",
-        type=float,
+        type=positive_float,
         default=1.0,
         help="Factor to resize images before sending to Gemini (e.g., 0.75 for 75%% size). Default is 1.0 (no resize).",
     )
+    parser.add_argument(
+        "--crop",
+        type=parse_crop,
+        default=NAME_POINTS_SUBREGION,
+        metavar="L,T,W,H",
+        help="Part of each screenshot to send to Gemini, relative to the capture region. Defaults to NAME_POINTS_SUBREGION.",
+    )
     parser.add_argument(
         "--screenshot-only",
         action="store_true",
         help="Only perform the screenshot capture phase and then exit.",
     )
+    parser.add_argument(
+        "--debug-ocr",
+        action="store_true",
+        help="Save the preprocessed OCR images to the analysis folder for debugging.",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Print a preview of the extracted data after exporting it.",
+    )
+    parser.add_argument(
+        "--keep-screenshots",
+        action="store_true",
+        help="Also save captured screenshots to the analysis folder (always on with --screenshot-only).",
+    )
     args = parser.parse_args()
+    DEBUG_OCR = args.debug_ocr or os.environ.get("GUILDBOT_DEBUG", "0") not in ("", "0")
 
     if args.analyze_only and args.screenshot_only:
         print("Error: --analyze-only and --screenshot-only cannot be used together.")
@@ -227,12 +556,24 @@ if __name__ == "__main__":
     os.makedirs("Results", exist_ok=True)
 
     all_guild_members_data = []
-    seen_members = set()  # To prevent duplicate entries during scrolling
-    screenshot_files = []
+    screenshots = []  # PNG-encoded captures, kept in memory for analysis
+    save_screenshots = args.keep_screenshots or args.screenshot_only
+
+    # Captures are only kept in memory by default, so make sure they can be
+    # analysed before asking the user to scroll through the whole list
+    if (
+        not args.analyze_only
+        and not save_screenshots
+        and not os.environ.get("GEMINI_API_KEY")
+    ):
+        print(
+            "Error: GEMINI_API_KEY environment variable not set. Set it, or use --keep-screenshots or --screenshot-only to capture without analysing."
+        )
+        exit()
 
     if not args.analyze_only:
         consecutive_same_captures = 0
-        previous_screenshot = None
+        previous_hash = None
 
         print("Starting automated guild data extraction...")
         print(
@@ -251,95 +592,220 @@ if __name__ == "__main__":
 
         # --- Capture Phase ---
         print("\n--- Starting Capture Phase ---")
-        for i in range(MAX_CAPTURES):
-            screenshot_filename = os.path.join(
-                ANALYSIS_FOLDER, f"guild_screenshot_{i}.png"
-            )
-
-            try:
-                # Check for manual stop signal
-                if stop_capture_flag:
-                    print("Manual stop detected. Stopping capture.")
-                    break
-
-                # Take and save screenshot
-                print(f"Taking screenshot {i+1}...")
-                current_screenshot = pyautogui.screenshot(region=GAME_WINDOW_REGION)
-                current_screenshot.save(screenshot_filename)
-                screenshot_files.append(screenshot_filename)
-
-                # Compare with previous screenshot to detect end of scrolling
-                if previous_screenshot is not None:
-                    # Convert to numpy arrays for comparison
-                    current_np = np.array(current_screenshot)
-                    previous_np = np.array(previous_screenshot)
-                    if np.array_equal(current_np, previous_np):
-                        consecutive_same_captures += 1
-                        print(
-                            f"  Identical screenshot detected ({consecutive_same_captures}/2)."
+        left, top, width, height = GAME_WINDOW_REGION
+        monitor = {"left": left, "top": top, "width": width, "height": height}
+        frames_captured = 0
+        encode_futures = []
+        save_futures = []
+        pending_encodes = threading.BoundedSemaphore(CAPTURE_QUEUE_SIZE)
+        if save_screenshots:
+            import tifffile
+
+            # Write to a temporary file so the previous session survives
+            # until this one has saved at least one frame
+            session_context = tifffile.TiffWriter(SESSION_TIFF_TMP, bigtiff=True)
+        else:
+            session_context = contextlib.nullcontext()
+        try:
+            # The writer is entered before the save pool so it is only closed
+            # once every queued page has been written
+            with (
+                session_context as session_writer,
+                mss.mss() as sct,
+                concurrent.futures.ThreadPoolExecutor(max_workers=2) as encode_pool,
+                concurrent.futures.ThreadPoolExecutor(max_workers=1) as save_pool,
+            ):
+                for i in range(MAX_CAPTURES):
+                    try:
+                        # Check for manual stop signal
+                        if stop_capture_flag:
+                            print("Manual stop detected. Stopping capture.")
+                            break
+
+                        # Take screenshot
+                        print(f"Taking screenshot {i+1}...")
+                        raw = sct.grab(monitor)
+                        current_screenshot = np.frombuffer(raw.rgb, np.uint8).reshape(
+                            raw.height, raw.width, 3
                         )
+                        frames_captured += 1
+                        # Hand encoding to the workers; blocks if they fall behind.
+                        # Screenshot-only runs never analyse, so skip the encode.
+                        if not args.screenshot_only:
+                            pending_encodes.acquire()
+                            future = encode_pool.submit(
+                                _encode_screenshot, current_screenshot, args.crop
+                            )
+                            future.add_done_callback(
+                                lambda _: pending_encodes.release()
+                            )
+                            encode_futures.append(future)
+                        if session_writer is not None:
+                            # Single writer thread keeps pages in capture order
+                            save_futures.append(
+                                save_pool.submit(
+                                    session_writer.write,
+                                    current_screenshot,
+                                    photometric="rgb",
+                                    compression="zlib",
+                                )
+                            )
+
+                        # Compare with previous screenshot to detect end of scrolling
+                        current_hash = dhash(current_screenshot)
+                        if previous_hash is not None:
+                            if (
+                                hash_distance(current_hash, previous_hash)
+                                <= DUPLICATE_HASH_THRESHOLD
+                            ):
+                                consecutive_same_captures += 1
+                                print(
+                                    f"  Identical screenshot detected ({consecutive_same_captures}/2)."
+                                )
+                            else:
+                                consecutive_same_captures = 0  # Reset counter
+
+                        previous_hash = current_hash
+
+                        if (
+                            consecutive_same_captures >= 2
+                        ):  # 2 means 3 identical frames in a row
+                            print(
+                                "Three consecutive identical captures detected. Stopping capture."
+                            )
+                            break
+
+                        time.sleep(0.75)  # Wait for user to scroll
+
+                    except mss.exception.ScreenShotError as e:
+                        print(f"Screen capture error: {e}. Stopping.")
+                        break
+                    except Exception as e:
+                        print(f"An error occurred during capture: {e}. Stopping.")
+                        break
+
+                # Let queued frames finish encoding and saving before analysis
+                concurrent.futures.wait(encode_futures + save_futures)
+        finally:
+            # Publish the new session only if it holds at least one frame
+            if save_screenshots:
+                frames_saved = 0
+                # The pools have shut down by now, so every future is done
+                for future in save_futures:
+                    if future.exception() is not None:
+                        print(f"Could not save a screenshot: {future.exception()}")
                     else:
-                        consecutive_same_captures = 0  # Reset counter
-
-                previous_screenshot = current_screenshot
-
-                if (
-                    consecutive_same_captures >= 2
-                ):  # 2 means 3 identical frames in a row
-                    print(
-                        "Three consecutive identical captures detected. Stopping capture."
-                    )
-                    break
-
-                time.sleep(0.75)  # Wait for user to scroll
-
-            except pyautogui.PyAutoGUIException as e:
-                print(f"PyAutoGUI error during capture: {e}. Stopping.")
-                break
+                        frames_saved += 1
+                if frames_saved:
+                    os.replace(SESSION_TIFF_TMP, SESSION_TIFF)
+                    print(f"Saved {frames_saved} screenshots to {SESSION_TIFF}")
+                else:
+                    os.remove(SESSION_TIFF_TMP)
+                    print(f"No screenshots saved; {SESSION_TIFF} left unchanged.")
+
+        for future in encode_futures:
+            try:
+                screenshots.append(future.result())
             except Exception as e:
-                print(f"An error occurred during capture: {e}. Stopping.")
-                break
+                print(f"Could not encode a screenshot: {e}. Skipping it.")
 
         print(
-            f"\n--- Capture Phase Finished. Collected {len(screenshot_files)} screenshots. ---"
+            f"\n--- Capture Phase Finished. Collected {frames_captured} screenshots. ---"
         )
         if args.screenshot_only:
             print("Screenshot-only mode enabled. Exiting without analysis.")
             exit()
     else:
-        # --- Find existing files for analysis ---
+        # --- Find existing screenshots for analysis ---
         print("\n--- Analyze-Only Mode: Searching for existing screenshots ---")
-        screenshot_files = sorted(
-            glob.glob(os.path.join(ANALYSIS_FOLDER, "guild_screenshot_*.png"))
-        )
-        if not screenshot_files:
+        frames = []  # (dHash of the full frame, PNG-encoded crop) pairs
+        if os.path.exists(SESSION_TIFF):
+            import tifffile
+
+            try:
+                with tifffile.TiffFile(SESSION_TIFF) as tif:
+                    for page_number, page in enumerate(tif.pages, start=1):
+                        try:
+                            image = page.asarray()
+                        except Exception as e:
+                            print(
+                                f"Could not read page {page_number} of {SESSION_TIFF}: {e}. Skipping it."
+                            )
+                            continue
+                        frames.append(
+                            (dhash(image), _encode_screenshot(image, args.crop))
+                        )
+            except Exception as e:
+                # e.g. a file left truncated by a killed capture session
+                print(f"Could not read {SESSION_TIFF}: {e}.")
+        if frames:
+            print(f"Found {len(frames)} screenshots in {SESSION_TIFF}.")
+        else:
+            # Fall back to per-frame PNGs saved by older versions (or when the
+            # session TIFF is unreadable or holds no frames)
+            screenshot_files = sorted(
+                glob.glob(os.path.join(ANALYSIS_FOLDER, "guild_screenshot_*.png"))
+            )
+            if not screenshot_files:
+                print(
+                    f"No '{os.path.basename(SESSION_TIFF)}' or 'guild_screenshot_*.png' files found in the '{ANALYSIS_FOLDER}' directory. Exiting."
+                )
+            else:
+                print(f"Found {len(screenshot_files)} files to analyze.")
+                for screenshot_filename in screenshot_files:
+                    img = cv2.imread(screenshot_filename)
+                    if img is None:
+                        print(f"Could not read {screenshot_filename}. Skipping it.")
+                        continue
+                    img = img[:, :, ::-1]
+                    frames.append((dhash(img), _encode_screenshot(img, args.crop)))
+
+        screenshots = drop_near_duplicate_frames(frames)
+        if len(screenshots) < len(frames):
             print(
-                f"No 'guild_screenshot_*.png' files found in the '{ANALYSIS_FOLDER}' directory. Exiting."
+                f"Dropped {len(frames) - len(screenshots)} near-identical screenshots."
             )
-        else:
-            print(f"Found {len(screenshot_files)} files to analyze.")
 
     # --- Analysis Phase ---
-    if screenshot_files:
+    if screenshots:
         print("\n--- Starting Analysis Phase ---")
-        # --- Gemini AI Pipeline (processes all images in one go) ---
-        all_guild_members_data = extract_with_gemini(
-            screenshot_files, resize_factor=args.gemini_resize_factor
+        # --- Gemini AI Pipeline (concurrent sub-batches) ---
+        all_guild_members_data = asyncio.run(
+            extract_with_gemini(screenshots, resize_factor=args.gemini_resize_factor)
         )
 
-    # 6. Create DataFrame and Export to Excel
+        # Nothing was extracted from frames that only live in memory: save
+        # them so the session can be re-analysed with --analyze-only
+        if (
+            not all_guild_members_data
+            and not args.analyze_only
+            and not save_screenshots
+        ):
+            try:
+                save_session(screenshots)
+                print(
+                    f"No members extracted. Saved the screenshots to {SESSION_TIFF}; re-run with --analyze-only to retry."
+                )
+            except Exception as e:
+                print(f"Could not save the screenshots for a later retry: {e}")
+
+    # 6. Export to Excel, streaming rows straight into the workbook
     if all_guild_members_data:
-        # Remove duplicates based on Name and Points if any managed to sneak through
-        # Using a DataFrame's drop_duplicates is robust
-        df = (
-            pd.DataFrame(all_guild_members_data)
-            .drop_duplicates(subset=["Name", "Points"])
-            .reset_index(drop=True)
-        )
+        # Duplicates were already dropped while merging Gemini results
+        import xlsxwriter
+
         excel_filename = os.path.join("Results", "guild_members.xlsx")
-        df.to_excel(excel_filename, index=False)
+        workbook = xlsxwriter.Workbook(excel_filename, {"constant_memory": True})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, ["Name", "Points"])
+        for row, member in enumerate(all_guild_members_data, start=1):
+            worksheet.write_row(row, 0, [member.get("Name"), member.get("Points")])
+        workbook.close()
         print(
-            f"\nSuccessfully extracted {len(df)} unique guild members to {excel_filename}"
+            f"\nSuccessfully extracted {len(all_guild_members_data)} unique guild members to {excel_filename}"
         )
-        print("Data preview:")
-        print(df.head())
+        if args.preview:
+            import pandas as pd
+
+            print("Data preview:")
+            print(pd.DataFrame(all_guild_members_data).head())